@@ -0,0 +1,22 @@
+import io
+from PIL import Image, ImageOps
+
+# Runs inside the image worker processes, so this module deliberately imports
+# nothing but Pillow.
+
+# Phone photos are far larger than Gemini needs to read a receipt, so they are
+# shrunk to a 1600px long edge and re-encoded as JPEG before upload. Callers
+# send anything Pillow can't decode (e.g. HEIC, or a truncated upload) through
+# untouched for Gemini to try.
+MAX_IMAGE_EDGE = 1600
+JPEG_QUALITY = 82
+# An 8 MB PNG can still decode to hundreds of megapixels; Pillow refuses
+# anything over twice this instead of exhausting a worker's memory.
+Image.MAX_IMAGE_PIXELS = 50_000_000
+
+def preprocess_image(content):
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+    img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+    out = io.BytesIO()
+    img.convert("RGB").save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue()
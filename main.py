@@ -1,30 +1,67 @@
 import os
-import json
-import base64  
+import asyncio
+import string
+import multiprocessing
+from contextlib import asynccontextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+from hashlib import blake2b
+from cachetools import LRUCache
+from PIL import Image
+from imaging import preprocess_image
+import httpx
+import orjson
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
+from google import genai
+from google.genai import types
+from groq import AsyncGroq
 
 # 1. Load Environment Variables
 load_dotenv()
 
 # 2. Initialize App
-app = FastAPI()
+# Startup/shutdown for everything below; the helpers are defined further down.
+@asynccontextmanager
+async def lifespan(app):
+    start_split_batcher()
+    start_warmup()
+    yield
+    await stop_split_batcher()
+    close_image_pool()
+    await HTTPX.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+# Starlette parses and spools the whole multipart body before a handler runs,
+# so oversized requests are turned away here on their declared Content-Length,
+# before anything is received. (Registered before CORS so the 413 still carries
+# CORS headers.) Bodies without a Content-Length are capped by read_upload().
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 64 * 1024  # room for multipart headers and form fields
+
+@app.middleware("http")
+async def limit_request_size(request, call_next):
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_REQUEST_BYTES:
+        return JSONResponse(status_code=413, content={"detail": "Request too large"})
+    return await call_next(request)
 
 # 3. CORS CONFIGURATION
-origins = [
+ORIGINS = (
     "http://localhost:3000",
     "https://billa-rho.vercel.app",      # Your exact Vercel URL
     "https://billa-rho.vercel.app/"      # Trailing slash version
-]
+)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=origins,             # usage of the list above
+    allow_origins=ORIGINS,             # usage of the tuple above
     allow_credentials=True,
     allow_methods=["*"],               # Allow ALL methods (POST, GET, OPTIONS)
     allow_headers=["*"],               # Allow ALL headers
@@ -32,77 +69,563 @@ app.add_middleware(
 # --------------------------
 
 # 4. Setup AI Models
-vision_model = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash", 
-    temperature=0,
-    google_api_key=os.getenv("GOOGLE_API_KEY")
+# One HTTP/2 connection pool shared by both SDKs, so concurrent calls are
+# multiplexed over a few warm connections instead of one pool per client.
+HTTPX = httpx.AsyncClient(
+    http2=True,
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128)
+)
+
+# Scans go to Flash-Lite first and are only retried on Flash when the result
+# doesn't validate (see ScannedReceipt).
+VISION_MODEL = "gemini-2.5-flash-lite"
+VISION_FALLBACK_MODEL = "gemini-2.5-flash"
+gemini_client = genai.Client(
+    api_key=os.getenv("GOOGLE_API_KEY"),
+    # google-genai sends its own per-request timeout (None by default), which
+    # overrides the client's, so it has to be set here too (milliseconds)
+    http_options=types.HttpOptions(httpx_async_client=HTTPX, timeout=30_000)
 )
 
-chat_model = ChatGroq(
-    model="llama-3.3-70b-versatile",
+CHAT_MODEL = "llama-3.3-70b-versatile"
+CHAT_MAX_TOKENS = 700
+# /split only asks the LLM to map instructions to items (the math is done in
+# Python), which the small instant model handles at a fraction of the latency.
+SPLIT_MODEL = "llama-3.1-8b-instant"
+SPLIT_MAX_TOKENS = 1024
+groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=HTTPX)
+
+async def chat_completion(prompt, model=CHAT_MODEL, max_tokens=CHAT_MAX_TOKENS):
+    response = await groq_client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=max_tokens,
+        response_format={"type": "json_object"}
+    )
+    return response.choices[0].message.content
+
+# Cheapest possible completion, used only to get a live connection into the
+# pool ahead of a real request. Failures are ignored, and it gives up quickly
+# (no retries, short timeout) so nothing waiting on it is held up for long.
+WARMUP_TIMEOUT = 5.0
+
+async def warm_groq():
+    try:
+        await groq_client.with_options(max_retries=0, timeout=WARMUP_TIMEOUT).chat.completions.create(
+            model=SPLIT_MODEL,
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1
+        )
+    except Exception as e:
+        print(f"Warm-up Error: {e}")
+
+async def warm_gemini():
+    try:
+        await gemini_client.aio.models.generate_content(
+            model=VISION_MODEL,
+            contents="hi",
+            config=types.GenerateContentConfig(
+                max_output_tokens=1,
+                http_options=types.HttpOptions(timeout=int(WARMUP_TIMEOUT * 1000))
+            )
+        )
+    except Exception as e:
+        print(f"Warm-up Error: {e}")
+
+# Open the Groq and Gemini connections before the first user request instead of
+# paying the TLS + HTTP/2 setup on it. Runs in the background so a slow or
+# unreachable upstream never delays startup.
+warmup_tasks = set()
+
+def start_warmup():
+    for warm in (warm_groq, warm_gemini):
+        task = asyncio.create_task(warm())
+        warmup_tasks.add(task)
+        task.add_done_callback(warmup_tasks.discard)
+
+# Groq's JSON mode can't be combined with streaming, so the streamed variant
+# relies on the prompt alone to keep the output JSON.
+async def stream_chat_completion(prompt):
+    return await groq_client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=CHAT_MAX_TOKENS,
+        stream=True
+    )
+
+# 5. Prompts
+# PROMPT UPDATED: To handle quantities and line totals
+SCAN_PROMPT = """
+Extract all items from this receipt image. 
+For each line item, identify:
+1. Quantity (e.g., 2)
+2. Name (e.g., CRAVING SET)
+3. Unit Price (price for one)
+4. Total Line Price (Quantity * Unit Price)
+
+Also extract:
+- The Currency Symbol used (e.g., RM, $, SGD, etc.)
+- Total Service Tax (SST) / Service Charge
+- Total Amount of the entire bill
+
+Return strictly valid JSON in this format:
+{
+  "items": [
+    {"name": "ITEM NAME", "quantity": 1, "unit_price": 0.0, "total_price": 0.0}
+  ],
+  "currency": "SYMBOL",
+  "tax": 0.0,
+  "total": 0.0
+}
+"""
+
+# The LLM only maps the instructions onto receipt lines; the money math is done
+# in compute_split() so the totals are always exact.
+SPLIT_PROMPT_TMPL = string.Template("""
+You are parsing bill-splitting instructions. Do NOT do any arithmetic.
+
+INPUTS:
+- PEOPLE: $people
+- ITEMS (index: name x quantity):
+$items
+- INSTRUCTIONS: $instruction
+
+RULES:
+1. For every item the instructions assign, list who pays for it and the fraction of that item they pay.
+2. An item assigned to one person has fraction 1.0. A shared item gets one entry per person (e.g. 0.5 each for two people).
+3. Leave out items the instructions don't mention; they are split equally among ALL.
+4. Only use names exactly as they appear in PEOPLE.
+
+OUTPUT FORMAT:
+Return ONLY valid JSON. Do not use Markdown blocks.
+{
+    "assignments": [
+        {"item_index": 0, "person": "Person Name", "fraction": 1.0}
+    ]
+}
+""")
+
+CHAT_PROMPT_TMPL = string.Template("""
+You are a helpful AI Bill Assistant. You are modifying an existing bill split based on the user's request.
+
+CONTEXT:
+- RECEIPT DATA: $receipt
+- CHAT HISTORY: $history
+- USER REQUEST: "$message"
+
+INSTRUCTIONS:
+1. Read the User Request and update the split calculations accordingly.
+2. Keep the math precise.
+3. Be friendly but concise: keep the reply to one or two sentences.
+
+OUTPUT FORMAT:
+Return ONLY valid JSON. Do not use Markdown blocks.
+{
+    "reply": "Text response to the user (e.g., 'Sure, I've removed the tax for Tom.')",
+    "splits": [
+        {"name": "Person Name", "amount": 0.00, "items": "Item A (x1)..."}
+    ]
+}
+""")
+
+# 6. Vision Calls
+# The scan prompt is identical on every upload and is sent as the leading
+# content, so Gemini's implicit prefix caching discounts it automatically.
+# (An explicit cached context isn't used: SCAN_PROMPT is ~200 tokens, well
+# under the ~1,024-token minimum for explicit caches on the 2.5 Flash models.)
+async def call_vision(model, image_part):
+    response = await gemini_client.aio.models.generate_content(
+        model=model,
+        contents=[SCAN_PROMPT, image_part],
+        config=SCAN_CONFIG
+    )
+    # No text at all (e.g. blocked or empty candidate) parses as invalid JSON too
+    return orjson.loads(response.text or "")
+
+# By the time a handler runs the upload is already spooled (to disk past 1 MB),
+# so this cap doesn't limit bytes received; it keeps the file from being
+# loaded into RAM past MAX_UPLOAD_BYTES, reading it in chunks.
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+async def read_upload(file):
+    if file.size and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    buf = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        buf.extend(chunk)
+        if len(buf) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Image too large")
+    return bytes(buf)
+
+# Resizing a 12 MP photo takes long enough to stall every other request if it
+# runs on the event loop, so it's done in worker processes instead. The job
+# lives in imaging.py, which imports only Pillow, so spawned workers don't load
+# this module and its SDK clients just to unpickle it. Workers are
+# spawned rather than forked from the multi-threaded server process, and a pool
+# left broken by a dead worker (e.g. OOM-killed) is replaced on the next use.
+def new_image_pool():
+    return ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+
+image_pool = new_image_pool()
+
+async def run_preprocess_image(content):
+    global image_pool
+    loop = asyncio.get_running_loop()
+    pool = image_pool
+    try:
+        return await loop.run_in_executor(pool, preprocess_image, content)
+    except BrokenProcessPool:
+        print("Image Pool Error: worker died, restarting pool")
+        if image_pool is pool:
+            image_pool = new_image_pool()
+            pool.shutdown(wait=False)
+        return await loop.run_in_executor(image_pool, preprocess_image, content)
+
+def close_image_pool():
+    global image_pool
+    image_pool.shutdown(cancel_futures=True)
+    # Workers only start on first use, so this costs nothing unless the app
+    # is started again in the same process (e.g. tests)
+    image_pool = new_image_pool()
+
+# Parsed scan results keyed by a hash of the uploaded image, so re-uploads of
+# the same photo (retries on flaky mobile networks) skip the vision call.
+scan_results = LRUCache(maxsize=512)
+
+# 7. Split Batching
+# /split prompts are queued and flushed to Groq together, either when
+# SPLIT_MAX_BATCH_SIZE requests are waiting or SPLIT_MAX_LATENCY seconds after
+# the first one arrived. Each batch is dispatched concurrently on the shared
+# Groq connection pool while the batcher goes back to collecting. The queue and
+# batcher are created per app lifespan so they always belong to the running loop.
+SPLIT_MAX_BATCH_SIZE = 8
+SPLIT_MAX_LATENCY = 0.05
+SPLIT_TIMEOUT = 60.0
+split_queue = None
+split_batcher_task = None
+split_tasks = set()
+
+def fail_splits(entries, message):
+    for _, future in entries:
+        if not future.done():
+            future.set_exception(RuntimeError(message))
+
+async def dispatch_split_batch(batch):
+    results = await asyncio.gather(
+        *(chat_completion(prompt, SPLIT_MODEL, SPLIT_MAX_TOKENS) for prompt, _ in batch),
+        return_exceptions=True
+    )
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+async def split_batcher(queue):
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + SPLIT_MAX_LATENCY
+            while len(batch) < SPLIT_MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(dispatch_split_batch(batch))
+            split_tasks.add(task)
+            task.add_done_callback(split_tasks.discard)
+            batch = []
+    finally:
+        # Collected but never dispatched
+        fail_splits(batch, "Split batcher stopped")
+
+def on_split_batcher_done(queue, task):
+    if not task.cancelled() and task.exception():
+        print(f"Split Batcher Error: {task.exception()!r}")
+    pending = []
+    while not queue.empty():
+        pending.append(queue.get_nowait())
+    fail_splits(pending, "Split batcher stopped")
+
+def start_split_batcher():
+    global split_queue, split_batcher_task
+    split_queue = asyncio.Queue()
+    split_batcher_task = asyncio.create_task(split_batcher(split_queue))
+    split_batcher_task.add_done_callback(partial(on_split_batcher_done, split_queue))
+
+async def stop_split_batcher():
+    split_batcher_task.cancel()
+    try:
+        await split_batcher_task
+    except (asyncio.CancelledError, Exception):
+        pass  # a crash was already logged by on_split_batcher_done
+
+async def queue_split(prompt):
+    if split_batcher_task is None or split_batcher_task.done():
+        raise RuntimeError("Split batcher is not running")
+    future = asyncio.get_running_loop().create_future()
+    await split_queue.put((prompt, future))
+    return await asyncio.wait_for(future, SPLIT_TIMEOUT)
+
+# 8. Split Math
+CENT = Decimal("0.01")
+
+def to_decimal(value):
+    return Decimal(str(value or 0))
+
+def format_money(curr, amount):
+    return f"{curr} {amount.quantize(CENT, ROUND_HALF_EVEN)}"
+
+def format_share(share):
+    return f"{float(share):.2f}".rstrip("0").rstrip(".")
+
+def compute_split(receipt, assignments, people, apply_tax):
+    """Turns item assignments into per-person amounts that add up to the bill.
+
+    Invalid assignments are skipped. Whatever part of an item is left
+    unassigned is shared equally by everyone; fractions adding up to more than
+    the whole item are scaled down. The gap between the food subtotal and the
+    receipt total (tax, service charge, discounts) is spread in proportion to
+    each person's food cost, amounts are rounded half-even to cents and any
+    leftover pennies go to the first person.
+    """
+    curr = receipt.currency
+    items = receipt.items
+    names = {str(person).strip().lower(): person for person in people}
+
+    item_shares = [{} for _ in items]
+    for assignment in assignments:
+        if not isinstance(assignment, dict):
+            continue
+        index = assignment.get("item_index")
+        person = names.get(str(assignment.get("person", "")).strip().lower())
+        try:
+            fraction = to_decimal(assignment.get("fraction", 1))
+        except InvalidOperation:
+            continue
+        if (
+            person is None
+            or isinstance(index, bool) or not isinstance(index, int)
+            or not 0 <= index < len(items)
+            or not fraction.is_finite() or fraction <= 0
+        ):
+            continue
+        item_shares[index][person] = item_shares[index].get(person, 0) + fraction
+
+    subtotals = {person: Decimal(0) for person in people}
+    item_notes = {person: [] for person in people}
+    for item, shares in zip(items, item_shares):
+        price = to_decimal(item.total_price)
+        assigned = sum(shares.values(), Decimal(0))
+        if assigned > 1:
+            shares = {person: fraction / assigned for person, fraction in shares.items()}
+            assigned = Decimal(1)
+        remainder = (1 - assigned) / len(people)
+        for person in people:
+            share = shares.get(person, Decimal(0)) + remainder
+            if share:
+                subtotals[person] += price * share
+                item_notes[person].append(f"{item.name} (x{format_share(share)})")
+
+    food_subtotal = sum(subtotals.values(), Decimal(0))
+    tax = to_decimal(receipt.tax)
+    if apply_tax:
+        # Derive the ratio from the printed total so tax-inclusive prices,
+        # discounts and rounding are shared out rather than landing on people[0]
+        target = to_decimal(receipt.total) or food_subtotal + tax
+        tax_ratio = (target - food_subtotal) / food_subtotal if food_subtotal else Decimal(0)
+    else:
+        tax_ratio = Decimal(0)
+        target = food_subtotal
+    target = target.quantize(CENT, ROUND_HALF_EVEN)
+
+    amounts = {
+        person: (subtotal * (1 + tax_ratio)).quantize(CENT, ROUND_HALF_EVEN)
+        for person, subtotal in subtotals.items()
+    }
+    adjustment = target - sum(amounts.values(), Decimal(0))
+    amounts[people[0]] += adjustment
+
+    reasoning = [f"Food subtotal {format_money(curr, food_subtotal)}."]
+    if apply_tax:
+        reasoning.append(
+            f"Receipt total {format_money(curr, target)} (tax/service {format_money(curr, tax)}) "
+            f"vs food subtotal: {tax_ratio * 100:.2f}% applied to each person's food cost."
+        )
+    else:
+        reasoning.append("Tax/service excluded.")
+    reasoning.append("Food cost: " + ", ".join(
+        f"{person} {format_money(curr, subtotal)}" for person, subtotal in subtotals.items()
+    ) + ".")
+    if adjustment:
+        reasoning.append(f"Adjusted {people[0]} by {format_money(curr, adjustment)} so the total matches {format_money(curr, target)}.")
+
+    return {
+        "reasoning": " ".join(reasoning),
+        "splits": [
+            {"name": person, "amount": float(amounts[person]), "items": ", ".join(item_notes[person])}
+            for person in people
+        ]
+    }
+
+# 9. Data Structures
+class ReceiptItem(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    quantity: float
+    unit_price: float
+    total_price: float
+
+# Request-side receipt: fields the frontend may leave out fall back to the
+# same defaults /split always used.
+class Receipt(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    items: list[ReceiptItem]
+    currency: str = "RM"
+    tax: float = 0.0
+    total: float
+
+# Scan-side receipt, also sent to Gemini as the response schema. Every field is
+# required (no defaults) so the model can't leave currency or tax out.
+# A scan is trusted only if the line items (when prices already include tax)
+# or the line items plus tax land within 5% of the printed total; anything
+# else is re-read by the fallback model.
+SCAN_TOTAL_TOLERANCE = 0.05
+
+class ScannedReceipt(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    items: list[ReceiptItem]
+    currency: str
+    tax: float
+    total: float
+
+    @model_validator(mode="after")
+    def items_match_total(self):
+        items_sum = sum(item.total_price for item in self.items)
+        tolerance = SCAN_TOTAL_TOLERANCE * abs(self.total)
+        if min(abs(items_sum - self.total), abs(items_sum + self.tax - self.total)) > tolerance:
+            raise ValueError(
+                f"items ({items_sum:.2f}) with or without tax ({self.tax:.2f}) don't match total ({self.total:.2f})"
+            )
+        return self
+
+# Gemini returns JSON matching ScannedReceipt directly, so no fence stripping is needed.
+# Built once and shared by every scan request.
+SCAN_CONFIG = types.GenerateContentConfig(
     temperature=0,
-    groq_api_key=os.getenv("GROQ_API_KEY")
+    response_mime_type="application/json",
+    response_schema=ScannedReceipt
 )
 
-# 5. Data Structures
 class SplitRequest(BaseModel):
-    receipt_data: str
+    model_config = ConfigDict(frozen=True)
+
+    receipt_data: Receipt
     user_instruction: str
-    people_list: list
+    people_list: list[str]
     apply_tax: bool = True  # Toggle for tax inclusion
 
+    # The frontend sends the scanned receipt back as a JSON string; parse it
+    # here so pydantic validates it in the same pass as the rest of the body.
+    @field_validator("receipt_data", mode="before")
+    @classmethod
+    def parse_receipt_json(cls, value):
+        if isinstance(value, (str, bytes)):
+            return orjson.loads(value)
+        return value
+
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     receipt_data: str
     history: list 
     user_message: str
 
-# 6. Endpoints
+# 10. Endpoints
 
 @app.get("/")
 def home():
     return {"status": "Bill-a Brain is Active"}
 
+async def scan_upload(file):
+    content = await read_upload(file)
+    key = blake2b(content, digest_size=16).hexdigest()
+    if key in scan_results:
+        return scan_results[key]
+
+    try:
+        image = await run_preprocess_image(content)
+        image_part = types.Part.from_bytes(data=image, mime_type="image/jpeg")
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Image too large")
+    except OSError:  # includes UnidentifiedImageError and truncated files
+        image_part = types.Part.from_bytes(data=content, mime_type=file.content_type)
+
+    # Unparseable JSON (e.g. truncated output) escalates the same way as a
+    # receipt that fails validation
+    try:
+        result = await call_vision(VISION_MODEL, image_part)
+        ScannedReceipt.model_validate(result)
+    except ValueError as e:
+        print(f"Scan Escalation: {e}")
+        result = await call_vision(VISION_FALLBACK_MODEL, image_part)
+    scan_results[key] = result
+    return result
+
+# Names are matched case-insensitively, so "Lim" and "lim " are one person;
+# keeping both would bill them twice and break the total.
+def unique_people(people_list):
+    people = {}
+    for person in people_list:
+        name = person.strip()
+        if name:
+            people.setdefault(name.lower(), name)
+    return list(people.values())
+
+async def split_receipt(receipt, people_list, user_instruction, apply_tax):
+    people_list = unique_people(people_list)
+    if not people_list:
+        raise HTTPException(status_code=400, detail="people_list is empty")
+
+    # Phase 1: only ask the LLM who pays for what (skipped for an even split)
+    assignments = []
+    if user_instruction:
+        prompt = SPLIT_PROMPT_TMPL.substitute(
+            people=people_list,
+            items="\n".join(
+                f"  {index}: {item.name} x{format_share(item.quantity)}"
+                for index, item in enumerate(receipt.items)
+            ),
+            instruction=user_instruction
+        )
+        response = await queue_split(prompt)
+        assignments = orjson.loads(response).get("assignments")
+        if not isinstance(assignments, list):
+            assignments = []
+
+    # Phase 2: exact arithmetic in Python
+    result = compute_split(receipt, assignments, people_list, apply_tax)
+    return {"result": orjson.dumps(result).decode()}
+
 @app.post("/scan")
 async def scan_receipt(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-        base64_image = base64.b64encode(content).decode("utf-8")
-        
-        # PROMPT UPDATED: To handle quantities and line totals
-        prompt = """
-        Extract all items from this receipt image. 
-        For each line item, identify:
-        1. Quantity (e.g., 2)
-        2. Name (e.g., CRAVING SET)
-        3. Unit Price (price for one)
-        4. Total Line Price (Quantity * Unit Price)
-
-        Also extract:
-        - The Currency Symbol used (e.g., RM, $, SGD, etc.)
-        - Total Service Tax (SST) / Service Charge
-        - Total Amount of the entire bill
-
-        Return strictly valid JSON in this format:
-        {
-          "items": [
-            {"name": "ITEM NAME", "quantity": 1, "unit_price": 0.0, "total_price": 0.0}
-          ],
-          "currency": "SYMBOL",
-          "tax": 0.0,
-          "total": 0.0
-        }
-        """
-
-        image_data_uri = f"data:{file.content_type};base64,{base64_image}"
-        msg = HumanMessage(content=[
-            {"type": "text", "text": prompt},
-            {"type": "image_url", "image_url": {"url": image_data_uri}}
-        ])
-        
-        response = vision_model.invoke([msg])
-        clean_json = response.content.replace("```json", "").replace("```", "").strip()
-        return json.loads(clean_json)
-        
+        return await scan_upload(file)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Scan Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -110,82 +633,74 @@ async def scan_receipt(file: UploadFile = File(...)):
 @app.post("/split")
 async def split_bill(request: SplitRequest):
     try:
-        receipt_obj = json.loads(request.receipt_data)
-        curr = receipt_obj.get("currency", "RM")
-
-        # UPDATED PROMPT: Enforces single JSON object output to prevent parsing errors
-        prompt = """
-        ACT AS A SENIOR AUDITOR. Calculate exactly how much each person owes.
-
-        INPUTS:
-        - PEOPLE: {people}
-        - RECEIPT: {receipt}
-        - INSTRUCTIONS: {instruction}
-        - TAX/SVC INCLUDED: {tax_enabled}
-        
-        ALGORITHM:
-        1. Parse Instructions: If an item is assigned to a person, they pay 100%. If not mentioned, split equally among ALL.
-        2. Calculate Ratios: Determine the tax/service charge ratio based on the receipt totals.
-        3. Distribute: Apply the tax ratio to each person's raw food cost.
-        4. Reconcile: Ensure the sum of individual totals matches the Receipt Total exactly (adjust pennies on the first person if needed).
-
-        OUTPUT FORMAT:
-        Return ONLY valid JSON. Do not use Markdown blocks.
-        {{
-            "reasoning": "Brief log of the calculation steps and tax ratio used...",
-            "splits": [
-                {{"name": "Person Name", "amount": 0.00, "items": "Item A (x1), Item B (x0.5)"}}
-            ]
-        }}
-        """.format(
-            people=request.people_list,
-            receipt=request.receipt_data,
-            instruction=request.user_instruction or "Split everything equally.",
-            tax_enabled=request.apply_tax,
-            currency=curr
+        return await split_receipt(
+            request.receipt_data, request.people_list, request.user_instruction, request.apply_tax
         )
-
-        response = chat_model.invoke(prompt)
-        return {"result": response.content}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Split Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Scan + split in one round-trip. While the image is being read, a one-token
+# Groq call opens and warms the connection the split will reuse, so the
+# end-to-end time is roughly max(vision, warm-up) + split instead of a cold
+# Groq connection after the scan.
+@app.post("/process")
+async def process_receipt(
+    file: UploadFile = File(...),
+    people_list: list[str] = Form(...),
+    user_instruction: str = Form(""),
+    apply_tax: bool = Form(True)
+):
+    try:
+        vision_task = asyncio.create_task(scan_upload(file))
+        warmup_task = asyncio.create_task(warm_groq()) if user_instruction else None
+
+        receipt_obj = await vision_task
+        if warmup_task:
+            await warmup_task
+
+        receipt = Receipt.model_validate(receipt_obj)
+        split = await split_receipt(receipt, people_list, user_instruction, apply_tax)
+        return {"receipt": receipt_obj, **split}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Process Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def build_chat_prompt(request):
+    # Construct a context-aware prompt
+    return CHAT_PROMPT_TMPL.substitute(
+        receipt=request.receipt_data,
+        history=request.history,
+        message=request.user_message
+    )
+
 @app.post("/chat_modify")
 async def chat_modify_bill(request: ChatRequest):
     try:
-        # Construct a context-aware prompt
-        prompt = """
-        You are a helpful AI Bill Assistant. You are modifying an existing bill split based on the user's request.
-        
-        CONTEXT:
-        - RECEIPT DATA: {receipt}
-        - CHAT HISTORY: {history}
-        - USER REQUEST: "{message}"
-
-        INSTRUCTIONS:
-        1. Read the User Request and update the split calculations accordingly.
-        2. Keep the math precise.
-        3. Be friendly in your text response.
-
-        OUTPUT FORMAT:
-        Return ONLY valid JSON. Do not use Markdown blocks.
-        {{
-            "reply": "Text response to the user (e.g., 'Sure, I've removed the tax for Tom.')",
-            "splits": [
-                {{"name": "Person Name", "amount": 0.00, "items": "Item A (x1)..."}}
-            ]
-        }}
-        """.format(
-            receipt=request.receipt_data,
-            history=request.history,
-            message=request.user_message
-        )
-
-        response = chat_model.invoke(prompt)
-        clean_json = response.content.replace("```json", "").replace("```", "").strip()
-        return json.loads(clean_json)
+        prompt = build_chat_prompt(request)
+        response = await chat_completion(prompt)
+        return orjson.loads(response)
         
     except Exception as e:
         print(f"Chat Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Same as /chat_modify, but the raw JSON text is streamed as Groq generates it
+# so the UI can start rendering the reply before the completion finishes.
+@app.post("/chat_modify/stream")
+async def chat_modify_bill_stream(request: ChatRequest):
+    try:
+        stream = await stream_chat_completion(build_chat_prompt(request))
+    except Exception as e:
+        print(f"Chat Stream Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def tokens():
+        async for chunk in stream:
+            yield chunk.choices[0].delta.content or ""
+
+    return StreamingResponse(tokens(), media_type="text/plain")
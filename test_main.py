@@ -0,0 +1,289 @@
+import asyncio
+import os
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+import main
+from main import Receipt, compute_split
+
+
+def make_receipt(prices, tax=0.0, total=None):
+    return Receipt(
+        items=[
+            {"name": f"Item {index}", "quantity": 1, "unit_price": price, "total_price": price}
+            for index, price in enumerate(prices)
+        ],
+        currency="RM",
+        tax=tax,
+        total=sum(prices) + tax if total is None else total,
+    )
+
+
+def amounts(result):
+    return {split["name"]: split["amount"] for split in result["splits"]}
+
+
+def test_unassigned_items_split_equally():
+    result = compute_split(make_receipt([10.0, 20.0]), [], ["Lim", "Tom"], True)
+    assert amounts(result) == {"Lim": 15.0, "Tom": 15.0}
+
+
+def test_tax_spread_pro_rata():
+    receipt = make_receipt([30.0, 10.0], tax=4.0)
+    assignments = [
+        {"item_index": 0, "person": "Lim", "fraction": 1},
+        {"item_index": 1, "person": "Tom", "fraction": 1},
+    ]
+    result = compute_split(receipt, assignments, ["Lim", "Tom"], True)
+    assert amounts(result) == {"Lim": 33.0, "Tom": 11.0}
+
+
+def test_tax_inclusive_total_is_not_booked_to_first_person():
+    # SST already included in the item prices: items sum to the total
+    receipt = make_receipt([50.0, 50.0], tax=6.0, total=100.0)
+    assignments = [
+        {"item_index": 0, "person": "Lim", "fraction": 1},
+        {"item_index": 1, "person": "Tom", "fraction": 1},
+    ]
+    result = compute_split(receipt, assignments, ["Lim", "Tom"], True)
+    assert amounts(result) == {"Lim": 50.0, "Tom": 50.0}
+
+
+def test_discount_is_shared_pro_rata():
+    receipt = make_receipt([60.0, 40.0], total=90.0)
+    assignments = [
+        {"item_index": 0, "person": "Lim", "fraction": 1},
+        {"item_index": 1, "person": "Tom", "fraction": 1},
+    ]
+    result = compute_split(receipt, assignments, ["Lim", "Tom"], True)
+    assert amounts(result) == {"Lim": 54.0, "Tom": 36.0}
+
+
+def test_rounding_pennies_go_to_first_person():
+    result = compute_split(make_receipt([10.0]), [], ["Lim", "Tom", "Ali"], True)
+    assert amounts(result) == {"Lim": 3.34, "Tom": 3.33, "Ali": 3.33}
+    assert sum(amounts(result).values()) == 10.0
+
+
+def test_apply_tax_false_ignores_tax():
+    result = compute_split(make_receipt([10.0, 10.0], tax=2.0), [], ["Lim", "Tom"], False)
+    assert amounts(result) == {"Lim": 10.0, "Tom": 10.0}
+
+
+def test_partial_fraction_remainder_shared_equally():
+    assignments = [{"item_index": 0, "person": "Lim", "fraction": 0.5}]
+    result = compute_split(make_receipt([20.0]), assignments, ["Lim", "Tom"], True)
+    assert amounts(result) == {"Lim": 15.0, "Tom": 5.0}
+
+
+def test_over_assigned_fractions_are_normalised():
+    assignments = [
+        {"item_index": 0, "person": "Lim", "fraction": 1},
+        {"item_index": 0, "person": "Tom", "fraction": 1},
+    ]
+    result = compute_split(make_receipt([20.0]), assignments, ["Lim", "Tom", "Ali"], True)
+    assert amounts(result) == {"Lim": 10.0, "Tom": 10.0, "Ali": 0.0}
+
+
+def test_invalid_assignments_are_skipped():
+    assignments = [
+        "Lim",
+        None,
+        {"item_index": 0, "person": "Lim", "fraction": "half"},
+        {"item_index": 0, "person": "Lim", "fraction": "NaN"},
+        {"item_index": 0, "person": "Lim", "fraction": -1},
+        {"item_index": 5, "person": "Lim"},
+        {"item_index": True, "person": "Lim"},
+        {"item_index": 0, "person": "Nobody"},
+    ]
+    result = compute_split(make_receipt([20.0]), assignments, ["Lim", "Tom"], True)
+    assert amounts(result) == {"Lim": 10.0, "Tom": 10.0}
+
+
+def test_person_names_match_case_insensitively():
+    assignments = [{"item_index": 0, "person": " lim ", "fraction": 1}]
+    result = compute_split(make_receipt([20.0]), assignments, ["Lim", "Tom"], True)
+    assert amounts(result) == {"Lim": 20.0, "Tom": 0.0}
+
+
+ASSIGN_FIRST_ITEM_TO_LIM = '{"assignments": [{"item_index": 0, "person": "Lim", "fraction": 1}]}'
+
+SPLIT_BODY = {
+    "receipt_data": {
+        "items": [
+            {"name": "Nasi Lemak", "quantity": 1, "unit_price": 12.0, "total_price": 12.0},
+            {"name": "Teh Tarik", "quantity": 1, "unit_price": 10.0, "total_price": 10.0},
+        ],
+        "currency": "RM",
+        "tax": 0.0,
+        "total": 22.0,
+    },
+    "user_instruction": "Lim had the nasi lemak",
+    "people_list": ["Lim", "Tom"],
+}
+
+
+@pytest.fixture
+def groq_calls(monkeypatch):
+    """Stubs out every Groq call and records the prompts sent for /split."""
+    calls = []
+
+    async def chat_completion(prompt, *args):
+        calls.append(prompt)
+        return ASSIGN_FIRST_ITEM_TO_LIM
+
+    async def skip_warmup():
+        pass
+
+    async def aclose():
+        pass
+
+    monkeypatch.setattr(main, "chat_completion", chat_completion)
+    monkeypatch.setattr(main, "warm_groq", skip_warmup)
+    monkeypatch.setattr(main, "warm_gemini", skip_warmup)
+    monkeypatch.setattr(main.HTTPX, "aclose", aclose)
+    return calls
+
+
+def test_split_works_across_app_restarts(groq_calls):
+    for _ in range(2):
+        with TestClient(main.app) as client:
+            response = client.post("/split", json=SPLIT_BODY)
+            assert response.status_code == 200
+    assert len(groq_calls) == 2
+
+
+def test_dead_split_batcher_fails_requests_instead_of_hanging(groq_calls, monkeypatch):
+    async def crashing_batcher(queue):
+        await asyncio.sleep(0.1)
+        raise ValueError("boom")
+
+    monkeypatch.setattr(main, "split_batcher", crashing_batcher)
+    with TestClient(main.app) as client:
+        response = client.post("/split", json=SPLIT_BODY)
+        assert response.status_code == 500
+        assert "batcher" in response.json()["detail"]
+
+
+def scanned(prices, tax, total):
+    return {
+        "items": [
+            {"name": f"Item {index}", "quantity": 1, "unit_price": price, "total_price": price}
+            for index, price in enumerate(prices)
+        ],
+        "currency": "RM",
+        "tax": tax,
+        "total": total,
+    }
+
+
+@pytest.fixture
+def vision_calls(monkeypatch):
+    """Stubs image preprocessing and Gemini; returns (models called, replies by model)."""
+    calls = []
+    replies = {}
+
+    async def call_vision(model, image_part):
+        calls.append(model)
+        return replies[model]
+
+    async def passthrough(content):
+        return content
+
+    monkeypatch.setattr(main, "call_vision", call_vision)
+    monkeypatch.setattr(main, "run_preprocess_image", passthrough)
+    monkeypatch.setattr(main, "scan_results", main.LRUCache(maxsize=8))
+    return calls, replies
+
+
+def scan(image):
+    with TestClient(main.app) as client:
+        return client.post("/scan", files={"file": ("receipt.jpg", image, "image/jpeg")})
+
+
+@pytest.mark.parametrize("receipt", [
+    scanned([10.0, 20.0], tax=3.0, total=33.0),   # tax added on top
+    scanned([50.0, 50.0], tax=6.0, total=100.0),  # SST already in the prices
+])
+def test_consistent_scan_is_not_escalated(groq_calls, vision_calls, receipt):
+    calls, replies = vision_calls
+    replies[main.VISION_MODEL] = receipt
+    response = scan(b"receipt")
+    assert response.status_code == 200
+    assert response.json() == receipt
+    assert calls == [main.VISION_MODEL]
+
+
+def test_inconsistent_scan_escalates_to_fallback_model(groq_calls, vision_calls):
+    calls, replies = vision_calls
+    replies[main.VISION_MODEL] = scanned([10.0, 20.0], tax=3.0, total=80.0)
+    replies[main.VISION_FALLBACK_MODEL] = scanned([10.0, 20.0, 47.0], tax=3.0, total=80.0)
+    response = scan(b"receipt")
+    assert response.status_code == 200
+    assert response.json()["items"][-1]["total_price"] == 47.0
+    assert calls == [main.VISION_MODEL, main.VISION_FALLBACK_MODEL]
+
+
+def split_amounts(response):
+    return amounts(orjson.loads(response.json()["result"]))
+
+
+def test_duplicate_people_are_merged(groq_calls):
+    body = {**SPLIT_BODY, "people_list": ["Lim", " lim ", "Tom", "LIM"]}
+    with TestClient(main.app) as client:
+        response = client.post("/split", json=body)
+    assert response.status_code == 200
+    assert split_amounts(response) == {"Lim": 17.0, "Tom": 5.0}
+
+
+def test_non_string_people_are_rejected(groq_calls):
+    body = {**SPLIT_BODY, "people_list": [{"n": 1}]}
+    with TestClient(main.app) as client:
+        response = client.post("/split", json=body)
+    assert response.status_code == 422
+    assert groq_calls == []
+
+
+@pytest.mark.parametrize(
+    "receipt_data",
+    [SPLIT_BODY["receipt_data"], orjson.dumps(SPLIT_BODY["receipt_data"]).decode()],
+    ids=["dict", "json-string"],
+)
+def test_split_accepts_receipt_as_dict_or_json_string(groq_calls, receipt_data):
+    body = {**SPLIT_BODY, "receipt_data": receipt_data}
+    with TestClient(main.app) as client:
+        response = client.post("/split", json=body)
+    assert response.status_code == 200
+    assert split_amounts(response) == {"Lim": 17.0, "Tom": 5.0}
+    assert len(groq_calls) == 1
+
+
+@pytest.mark.parametrize(
+    "receipt_data",
+    ["not json", '{"items": 3, "total": 22.0}', {"items": [], "total": "lots"}],
+    ids=["bad-json", "bad-items", "bad-total"],
+)
+def test_malformed_receipt_is_rejected(groq_calls, receipt_data):
+    body = {**SPLIT_BODY, "receipt_data": receipt_data}
+    with TestClient(main.app) as client:
+        response = client.post("/split", json=body)
+    assert response.status_code == 422
+    assert groq_calls == []
+
+
+def test_oversized_request_rejected_before_parsing(groq_calls, vision_calls):
+    calls, _ = vision_calls
+    with TestClient(main.app) as client:
+        response = client.post(
+            "/scan",
+            files={"file": ("receipt.jpg", b"x" * (main.MAX_REQUEST_BYTES + 1), "image/jpeg")},
+            headers={"Origin": "http://localhost:3000"},
+        )
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+    assert calls == []